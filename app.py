@@ -1,18 +1,28 @@
 import json
 import re
+from functools import lru_cache
+try:
+    import ahocorasick  # For multi-keyword section matching
+except ImportError:  # classify_segment falls back to plain substring checks
+    ahocorasick = None
+import orjson  # For fast JSON serialization of the output
 import streamlit as st
-from datetime import datetime, timezone
+import time
 import spacy  # For Named Entity Recognition (NER)
 
+# Only NER is used, and in en_core_web_sm it carries its own tok2vec layer,
+# so the remaining components are never loaded
+SPACY_EXCLUDE = ["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer"]
+
 # Load spaCy's English model for NER with caching to avoid repeated downloads
 @st.cache_resource
 def load_spacy_model():
     try:
-        return spacy.load("en_core_web_sm")
+        return spacy.load("en_core_web_sm", exclude=SPACY_EXCLUDE)
     except OSError:
         st.warning("Downloading 'en_core_web_sm' model... This may take a few minutes.")
         spacy.cli.download("en_core_web_sm")
-        return spacy.load("en_core_web_sm")
+        return spacy.load("en_core_web_sm", exclude=SPACY_EXCLUDE)
 
 nlp = load_spacy_model()
 
@@ -22,20 +32,55 @@ SECTION_LABELS = [
     "Labs & Imaging", "Medications", "MDM", "Prior to Admission", "Uncategorized"
 ]
 
-# Mapping from original section to SOAP categories
-section_to_soap = {
-    "Chief Complaint": "Subjective",
-    "HPI": "Subjective",
-    "ROS": "Subjective",
-    "ED Vitals": "Objective",
-    "Physical Exam": "Objective",
-    "Labs & Imaging": "Objective",
-    "Medications": "Objective",
-    "MDM": "Assessment",
-    "Prior to Admission": "Plan",
-    "Uncategorized": "Other"
+# Integer section ids (indexes into SECTION_LABELS), used internally in place of labels
+SECTION_IDS = {section: section_id for section_id, section in enumerate(SECTION_LABELS)}
+UNCATEGORIZED_ID = SECTION_IDS["Uncategorized"]
+
+# SOAP categories and the sections grouped under each, in output order
+SOAP_GROUPS = {
+    "Subjective": ["Chief Complaint", "HPI", "ROS"],
+    "Objective": ["ED Vitals", "Physical Exam", "Labs & Imaging", "Medications"],
+    "Assessment": ["MDM"],
+    "Plan": ["Prior to Admission"],
+    "Other": ["Uncategorized"]
+}
+
+# Section keywords, in SECTION_LABELS order: the first section with a matching keyword wins
+SECTION_KEYWORDS = {
+    "Chief Complaint": ["chief complaint", "c/o", "complains of"],
+    "HPI": ["hpi", "history of present illness"],
+    "ROS": ["ros", "review of systems", "denies", "reports no"],
+    "ED Vitals": ["blood pressure", "bp", "heart rate", "hr", "o2 sat", "temperature", "vitals"],
+    "Physical Exam": ["physical exam", "exam", "heent", "lungs", "extremities", "no edema"],
+    "Labs & Imaging": ["lab", "labs", "wbc", "hgb", "x-ray", "ct scan", "mri", "imaging", "ekg"],
+    "Medications": ["medications:", "infusion", "scheduled meds", "prn meds"],
+    "MDM": ["mdm", "medical decision", "plan", "assessment", "differential"],
+    "Prior to Admission": ["prior to admission", "pta", "before arrival", "prior treatment"]
 }
 
+# Build the keyword automaton once per process rather than on every script rerun
+@st.cache_resource
+def build_keyword_automaton():
+    """
+    Build an Aho-Corasick automaton over all section keywords, valued by section id.
+    Returns None when pyahocorasick is not installed.
+    """
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for section, keywords in SECTION_KEYWORDS.items():
+        for keyword in keywords:
+            if keyword not in automaton:
+                automaton.add_word(keyword, SECTION_IDS[section])
+    automaton.make_automaton()
+    return automaton
+
+KEYWORD_AUTOMATON = build_keyword_automaton()
+
+# Sentence terminators, and abbreviations whose trailing period does not end a sentence
+_TERMINATORS = frozenset(".!?")
+_KNOWN_ABBR = frozenset({"Dr.", "Mr.", "Mrs.", "Ms.", "Prof.", "Sr.", "Jr."})
+
 # Title of the Streamlit app
 st.title("ED Note Formatter - Optimized for GPT-Based H&P Generation")
 
@@ -51,100 +96,158 @@ abbreviations = {
     # Add more abbreviations as needed
 }
 
+# Fuse all abbreviations into one alternation so each section is scanned once,
+# compiled once per abbreviation set rather than on every script rerun
+@st.cache_resource
+def build_abbreviation_matcher(abbr_items: tuple):
+    """
+    Compile (term, abbreviation) pairs into whole-word alternations.
+    Returns (pattern, replacements, lowercase pattern, lowercase lookup), or None when there
+    are no terms to replace. The case-insensitive pattern has one group per term, and group N
+    is replaced by replacements[N - 1]. The lowercase pattern and lookup are None unless every
+    term is ASCII. Longest terms come first so multi-word terms win over any overlapping shorter term.
+    """
+    if not abbr_items:
+        return None
+    ordered = sorted(abbr_items, key=lambda item: len(item[0]), reverse=True)
+    abbr_re = re.compile(
+        r'\b(?:' + '|'.join(f'({re.escape(term)})' for term, _ in ordered) + r')\b', flags=re.IGNORECASE
+    )
+    replacements = tuple(abbr for _, abbr in ordered)
+    lowered_re = lowered_lookup = None
+    if all(term.isascii() for term, _ in ordered):
+        lowered_re = re.compile(r'\b(?:' + '|'.join(re.escape(term.lower()) for term, _ in ordered) + r')\b')
+        lowered_lookup = {}
+        for term, abbr in ordered:
+            lowered_lookup.setdefault(term.lower(), abbr)  # first term wins, as in the alternation
+    return abbr_re, replacements, lowered_re, lowered_lookup
+
+ABBR_MATCHER = build_abbreviation_matcher(tuple(abbreviations.items()))
+
+# Cache per input text so repeat clicks skip the NER pass
+@st.cache_data(max_entries=64, show_spinner=False)
 def remove_names(text: str) -> str:
     """
     Remove names from the text using spaCy's Named Entity Recognition (NER).
+    Text between PERSON entities is copied through as-is, so only entities are visited.
     """
     doc = nlp(text)
     cleaned_text = []
-    for token in doc:
-        if token.ent_type_ != "PERSON":  # Filter out PERSON entities
-            cleaned_text.append(token.text)
-    return " ".join(cleaned_text)
+    last_end = 0
+    for ent in doc.ents:
+        if ent.label_ == "PERSON":  # Filter out PERSON entities
+            cleaned_text.append(text[last_end:ent.start_char])
+            last_end = ent.end_char
+    cleaned_text.append(text[last_end:])
+    return "".join(cleaned_text)
 
-def classify_segment(segment: str) -> str:
+# Classification is pure, so repeated boilerplate sentences are looked up rather than rescanned
+@lru_cache(maxsize=4096)
+def classify_segment(segment: str) -> int:
     """
     Classify a text segment into an ED note section using rule-based keyword matching.
+    Returns the section id; every keyword hit is found in one automaton pass and the lowest id wins.
     """
     text = segment.lower()
-    keyword_map = {
-        "Chief Complaint": ["chief complaint", "c/o", "complains of"],
-        "HPI": ["hpi", "history of present illness"],
-        "ROS": ["ros", "review of systems", "denies", "reports no"],
-        "ED Vitals": ["blood pressure", "bp", "heart rate", "hr", "o2 sat", "temperature", "vitals"],
-        "Physical Exam": ["physical exam", "exam", "heent", "lungs", "extremities", "no edema"],
-        "Labs & Imaging": ["lab", "labs", "wbc", "hgb", "x-ray", "ct scan", "mri", "imaging", "ekg"],
-        "Medications": ["medications:", "infusion", "scheduled meds", "prn meds"],
-        "MDM": ["mdm", "medical decision", "plan", "assessment", "differential"],
-        "Prior to Admission": ["prior to admission", "pta", "before arrival", "prior treatment"]
-    }
-    for section, keywords in keyword_map.items():
-        if any(keyword in text for keyword in keywords):
-            return section
-    return "Uncategorized"
+    if KEYWORD_AUTOMATON is None:
+        for section, keywords in SECTION_KEYWORDS.items():
+            if any(keyword in text for keyword in keywords):
+                return SECTION_IDS[section]
+        return UNCATEGORIZED_ID
+    return min((section_id for _, section_id in KEYWORD_AUTOMATON.iter(text)), default=UNCATEGORIZED_ID)
 
-def split_text_into_segments(text: str) -> list:
+def iter_segments(text: str):
     """
-    Split the input text into sentences without breaking abbreviations.
-    Uses word-based splitting instead of regex look-behind.
+    Yield the input text as sentences without breaking abbreviations.
+    Uses word-based splitting instead of regex look-behind; segments are
+    produced one at a time rather than collected into a list.
     """
-    known_abbreviations = {"Dr.", "Mr.", "Mrs.", "Ms.", "Prof.", "Sr.", "Jr."}
-    words = text.split()
-    segments = []
     current_sentence = []
-    for word in words:
+    for word in text.split():
         current_sentence.append(word)
         # End segment at sentence-ending punctuation if not an abbreviation
-        if word.endswith((".", "!", "?")) and word not in known_abbreviations:
-            segments.append(" ".join(current_sentence))
+        # (words from str.split() are never empty, so word[-1] is safe)
+        if word[-1] in _TERMINATORS and word not in _KNOWN_ABBR:
+            yield " ".join(current_sentence)
             current_sentence = []
     if current_sentence:
-        segments.append(" ".join(current_sentence))
-    return [s.strip() for s in segments if s.strip()]
+        yield " ".join(current_sentence)
 
-def format_ed_data(text: str, abbr_dict: dict) -> dict:
+def replace_abbreviations(content: str, abbr_matcher) -> str:
+    """
+    Replace full terms with abbreviations (case-insensitive whole-word matches).
+    For ASCII text and terms, matches are found on one lowercased copy, which is cheaper
+    than re.IGNORECASE, and replacements are spliced into the original text. Other
+    input is matched case-insensitively and replaced by the matched term's group.
+    """
+    if abbr_matcher is None:
+        return content
+    abbr_re, replacements, lowered_re, lowered_lookup = abbr_matcher
+    if lowered_re is None or not content.isascii():
+        # Unicode case-insensitive matching is not the same as comparing lower() output
+        # ("ſ" matches "s", "İ" matches "i"), so non-ASCII input uses the IGNORECASE pattern
+        return abbr_re.sub(lambda m: replacements[m.lastindex - 1], content)
+    replaced_text = []
+    last_end = 0
+    for match in lowered_re.finditer(content.lower()):
+        replaced_text.append(content[last_end:match.start()])
+        # A match on lowered text is always a lowercase term; keep the original text if not
+        replaced_text.append(lowered_lookup.get(match[0], content[match.start():match.end()]))
+        last_end = match.end()
+    replaced_text.append(content[last_end:])
+    return "".join(replaced_text)
+
+# Result for empty or whitespace-only input
+_EMPTY_ERR = {"Error": "No data provided"}
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def format_ed_data(text: str, abbr_matcher) -> dict:
     """
     Format ED note data with abbreviation replacement.
+    `abbr_matcher` is the result of build_abbreviation_matcher, or None to skip replacement.
     """
-    if not text or not text.strip():
-        return {"Error": "No data provided"}
+    # isspace() stops at the first non-space character and allocates nothing
+    if not text or text.isspace():
+        return _EMPTY_ERR
     # Remove personal names using NER
     text = remove_names(text)
-    structured_data = {section: "" for section in SECTION_LABELS}
+    # Collect segments per section and join once, avoiding repeated string growth
+    buckets = [[] for _ in SECTION_LABELS]
     # Split text into sentence segments
-    segments = split_text_into_segments(text)
-    for segment in segments:
-        section = classify_segment(segment)
-        structured_data[section] += segment.strip() + "\n\n"
-    # Replace full terms with abbreviations (case-insensitive whole-word matches)
+    for segment in iter_segments(text):
+        buckets[classify_segment(segment)].append(segment)  # segments from iter_segments are already stripped
+    structured_data = {section: "\n\n".join(parts) for section, parts in zip(SECTION_LABELS, buckets)}
+    # Replace full terms with abbreviations in each non-empty section
     for section, content in structured_data.items():
-        for term, abbr in abbr_dict.items():
-            pattern = re.compile(rf'\b{re.escape(term)}\b', flags=re.IGNORECASE)
-            content = pattern.sub(abbr, content)
-        structured_data[section] = content.strip()
+        if not content:
+            continue
+        structured_data[section] = replace_abbreviations(content, abbr_matcher).strip()
     return structured_data
 
 def convert_to_soap(structured_data: dict) -> dict:
     """
     Convert the structured data into a nested JSON (SOAP format) for output.
     """
-    soap_data = {"Subjective": {}, "Objective": {}, "Assessment": {}, "Plan": {}, "Other": {}}
-    for section, content in structured_data.items():
-        if content.strip():
-            soap_category = section_to_soap.get(section, "Other")
-            soap_data[soap_category][section] = content.strip()
+    soap_data = {}
+    for soap_category, sections in SOAP_GROUPS.items():
+        soap_data[soap_category] = {}
+        for section in sections:
+            content = structured_data.get(section, "").strip()
+            if content:
+                soap_data[soap_category][section] = content
     metadata = {
-        "generated_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         "note_version": "1.1"
     }
     return {"metadata": metadata, "note": soap_data}
 
 # Run processing when button is clicked
 if st.button("Format Data to Enhanced SOAP JSON"):
-    result = format_ed_data(raw_text, abbreviations)
+    result = format_ed_data(raw_text, ABBR_MATCHER)
     if "Error" in result:
         st.error(result["Error"])
     else:
         soap_result = convert_to_soap(result)
         st.subheader("Structured ED Note (Optimized for GPT-Based H&P)")
-        st.json(soap_result)
+        # st.json renders a pre-serialized string as-is, skipping its stdlib json.dumps
+        st.json(orjson.dumps(soap_result).decode())